@@ -1,8 +1,16 @@
 import requests
 import json
+import orjson
 import time
+import heapq
+import re
+import tempfile
 from datetime import datetime, timezone
 import os
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Configuration - using environment variables for security
 SEATS_API_KEY = os.environ.get("SEATS_API_KEY")
@@ -12,59 +20,213 @@ TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
 # File to persist daily message timestamp (in repo for GitHub Actions)
 DAILY_TIMESTAMP_FILE = "last_daily_message.txt"
 
+# API endpoints and static request parts, built once at import
+_SEATS_URL = "https://seats.aero/partnerapi/search"
+_SEATS_HEADERS = {
+    "accept": "application/json",
+    "Partner-Authorization": SEATS_API_KEY
+}
+_TG_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+_TG_BASE_DATA = {
+    "chat_id": TELEGRAM_CHAT_ID,
+    "parse_mode": "Markdown",
+    "disable_web_page_preview": True
+}
+
+# seats.aero rows per page, and the most pages followed for one query
+SEATS_PAGE_SIZE = 500
+SEATS_MAX_PAGES = 10
+
+# Number of seats.aero queries allowed in flight at once
+MAX_FETCH_WORKERS = 8
+
+def create_session(pool_maxsize=1):
+    """Create a pooled HTTP session with keep-alive and retries on gateway errors"""
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    # Each session talks to a single host; pool_block caps open sockets at pool_maxsize
+    # so extra threads wait for a kept-alive connection instead of opening throwaway ones
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retries, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Shared sessions so repeated calls reuse TCP/TLS connections
+SEATS_SESSION = create_session(pool_maxsize=MAX_FETCH_WORKERS)
+SEATS_SESSION.headers.update(_SEATS_HEADERS)
+TG_SESSION = create_session()
+
+# Telegram rejects messages over 4096 chars and allows ~30 messages per second
+TELEGRAM_MAX_MESSAGE_LENGTH = 3900
+TELEGRAM_RATE_LIMIT = 30
+_tg_send_times = deque()  # monotonic timestamps of sends in the last second
+
+# Whether the negotiated seats.aero content-encoding has been logged yet
+_seats_encoding_logged = False
+
+# Flag shown next to each award program in notifications
+_PROGRAM_EMOJI = {"alaska": "🇺🇸", "aeroplan": "🇨🇦"}
+
+# Shared read-only fallback for missing nested dicts
+_EMPTY = {}
+
 def get_current_time():
     """Get current UTC time for consistent timezone handling"""
     return datetime.now(timezone.utc)
 
 
-def check_seats(origins, destinations, start_date, end_date, cabin="business", direct_only=False):
-    """Check seats availability for multiple origins/destinations"""
+def write_file_atomic(path, content):
+    """Write content to path so readers only ever see the old or the complete new file"""
+    # mkstemp creates the temp file exclusively with a random name, so a pre-planted symlink can't redirect the write
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def log_seats_encoding(response):
+    """Log the negotiated content-encoding of the first seats.aero response"""
+    global _seats_encoding_logged
+    if not _seats_encoding_logged:
+        _seats_encoding_logged = True
+        print(f"seats.aero response encoding: {response.headers.get('content-encoding', 'identity')}")
+
+def check_seats(origins, destinations, start_date, end_date, cabin="business", direct_only=False, sources=None):
+    """Check seats availability for multiple origins/destinations, following result pages"""
     origins_str = ",".join(origins) if isinstance(origins, list) else origins
     destinations_str = ",".join(destinations) if isinstance(destinations, list) else destinations
-
-    only_direct = "true" if direct_only else "false"
-    url = f"https://seats.aero/partnerapi/search?origin_airport={origins_str}&destination_airport={destinations_str}&start_date={start_date}&end_date={end_date}&take=500&include_trips=false&only_direct_flights={only_direct}&include_filtered=false&cabins={cabin}"
-
-    headers = {
-        "accept": "application/json",
-        "Partner-Authorization": SEATS_API_KEY
+    sources_str = ",".join(sources) if isinstance(sources, list) else sources
+
+    params = {
+        "origin_airport": origins_str,
+        "destination_airport": destinations_str,
+        "start_date": start_date,
+        "end_date": end_date,
+        "take": SEATS_PAGE_SIZE,
+        "include_trips": "false",
+        "only_direct_flights": "true" if direct_only else "false",
+        "include_filtered": "false",
+        "cabins": cabin
     }
+    if sources_str:
+        # Only fetch rows for the programs we monitor
+        params["sources"] = sources_str
 
     try:
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        return response.json()
+        rows = []
+        for page_number in range(SEATS_MAX_PAGES):
+            params["skip"] = page_number * SEATS_PAGE_SIZE
+            response = SEATS_SESSION.get(_SEATS_URL, params=params, timeout=30)
+            response.raise_for_status()
+            log_seats_encoding(response)
+            page = orjson.loads(response.content)
+            page_rows = page.get("data") or []
+            rows.extend(page_rows)
+
+            if not page.get("hasMore"):
+                if "hasMore" not in page and len(page_rows) >= SEATS_PAGE_SIZE:
+                    print(f"⚠️ seats.aero returned a full page for {origins_str}→{destinations_str} - results may be truncated")
+                break
+            if page.get("cursor"):
+                params["cursor"] = page["cursor"]
+        else:
+            print(f"⚠️ seats.aero results for {origins_str}→{destinations_str} truncated at {len(rows)} rows")
+
+        return {**page, "data": rows}
     except Exception as e:
         print(f"Error checking seats: {e}")
         return None
 
+def _split_keep(text, separator):
+    """Split text on separator, keeping the separator at the end of each piece"""
+    parts = text.split(separator)
+    return [part + separator for part in parts[:-1]] + [parts[-1]]
+
+def split_message(message, limit=TELEGRAM_MAX_MESSAGE_LENGTH):
+    """Split a Markdown message into (chunk, is_markdown) pairs under limit, on paragraph boundaries where possible"""
+    if len(message) <= limit:
+        return [(message, True)]
+
+    # (text, markdown_safe) - hard cuts can split a Markdown entity, so they aren't safe to parse
+    pieces = []
+    for paragraph in _split_keep(message, "\n\n"):
+        if len(paragraph) <= limit:
+            pieces.append((paragraph, True))
+            continue
+        # Oversized paragraph - fall back to line boundaries, then hard cuts
+        for line in _split_keep(paragraph, "\n"):
+            if len(line) <= limit:
+                pieces.append((line, True))
+            else:
+                pieces.extend((line[i:i + limit], False) for i in range(0, len(line), limit))
+
+    chunks = []
+    current = ""
+    current_safe = True
+    for piece, safe in pieces:
+        if len(current) + len(piece) > limit:
+            chunks.append((current, current_safe))
+            current = ""
+            current_safe = True
+        current += piece
+        current_safe = current_safe and safe
+    chunks.append((current, current_safe))
+
+    return [(chunk, is_markdown) for chunk, is_markdown in chunks if chunk.strip()]
+
+def _wait_for_telegram_slot():
+    """Block until another send stays within Telegram's per-second rate limit"""
+    now = time.monotonic()
+    while _tg_send_times and now - _tg_send_times[0] >= 1:
+        _tg_send_times.popleft()
+
+    if len(_tg_send_times) >= TELEGRAM_RATE_LIMIT:
+        time.sleep(1 - (now - _tg_send_times[0]))
+        _tg_send_times.popleft()
+
+    _tg_send_times.append(time.monotonic())
+
 def send_telegram_message(message):
-    """Send message to Telegram"""
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-
-    data = {
-        "chat_id": TELEGRAM_CHAT_ID,
-        "text": message,
-        "parse_mode": "Markdown",
-        "disable_web_page_preview": True
-    }
+    """Send message to Telegram, split into several messages if it is too long"""
+    chunks = split_message(message)
 
     try:
-        response = requests.post(url, data=data, timeout=10)
-        response.raise_for_status()
-        print("✅ Telegram message sent successfully")
+        # All chunks go over the same kept-alive connection
+        for chunk, is_markdown in chunks:
+            data = {**_TG_BASE_DATA, "text": chunk}
+            if not is_markdown:
+                # Chunk was hard-cut and may hold half an entity - send it as plain text
+                del data["parse_mode"]
+
+            _wait_for_telegram_slot()
+            response = TG_SESSION.post(_TG_URL, data=data, timeout=10)
+            response.raise_for_status()
+
+        if len(chunks) > 1:
+            print(f"✅ Telegram message sent successfully ({len(chunks)} parts)")
+        else:
+            print("✅ Telegram message sent successfully")
         return True
     except Exception as e:
         print(f"❌ Error sending Telegram message: {e}")
         return False
 
-def filter_by_airline(item, required_airlines):
+def compile_airline_pattern(airlines):
+    """Compile airline codes into one regex matching any of them (None means no restriction)"""
+    if not airlines:
+        return None
+    return re.compile("|".join(re.escape(airline) for airline in sorted(airlines)))
+
+def filter_by_airline(item, airline_pattern):
     """Check if flight has required airlines"""
-    if not required_airlines:
+    if airline_pattern is None:
         return True  # No airline restriction
 
     airlines = item.get("JAirlines", "")  # Business class airlines
-    return any(airline in airlines for airline in required_airlines)
+    return airline_pattern.search(airlines) is not None
 
 def filter_by_direct(item, direct_only=False):
     """Check if flight is direct when required"""
@@ -72,204 +234,283 @@ def filter_by_direct(item, direct_only=False):
         return True
     return item.get("JDirect", False)
 
-def filter_by_route_preferences(item, route_preferences):
+def build_route_preference_index(route_preferences):
+    """Index route preferences as (origin, destination) -> airline pattern (None means any)"""
+    pref_index = {}
+    for pref in route_preferences:
+        airlines = frozenset(pref["airlines"] or ())
+        for origin in pref["origins"]:
+            for destination in pref["destinations"]:
+                key = (origin, destination)
+                if key not in pref_index:
+                    pref_index[key] = airlines
+                elif not pref_index[key] or not airlines:
+                    # A preference without an airline restriction accepts any airline
+                    pref_index[key] = frozenset()
+                else:
+                    pref_index[key] = pref_index[key] | airlines
+    return {key: compile_airline_pattern(airlines) for key, airlines in pref_index.items()}
+
+def filter_by_route_preferences(item, pref_index):
     """Check if flight matches any of the route preferences"""
-    if not route_preferences:
+    if not pref_index:
         return True  # No preferences means accept all
 
-    origin = item.get("Route", {}).get("OriginAirport", "")
-    destination = item.get("Route", {}).get("DestinationAirport", "")
-    airlines = item.get("JAirlines", "")
+    route = item.get("Route") or _EMPTY
+    key = (route.get("OriginAirport", ""), route.get("DestinationAirport", ""))
 
-    # Check if this flight matches any route preference
-    for pref in route_preferences:
-        # Check origin match
-        if origin not in pref["origins"]:
+    # Origin/destination pair not covered by any preference
+    if key not in pref_index:
+        return False
+
+    return filter_by_airline(item, pref_index[key])
+
+def has_business_availability(item):
+    """Check if business class seats are available"""
+    return bool(item.get("JAvailable")) and item.get("JRemainingSeats", 0) > 0
+
+# Search configurations for your target periods (Optimized for fewer API calls)
+_SEARCH_CONFIG = {
+    # December 5-15, 2025 (US to Asia)
+    "dec_us_to_asia": {
+        "date_range": ("2025-12-05", "2025-12-15"),
+        "routes": {
+            "alaska": [
+                {
+                    "name": "ORD→HKG (Any airline, connecting OK)",
+                    "origins": ["ORD"],
+                    "destinations": ["HKG"],
+                    "airlines": None,  # Any airline
+                    "max_miles": 85000
+                },
+                {
+                    "name": "US→Asia (Direct flights only)",
+                    "origins": ["ORD", "DFW", "LAX", "SFO"],
+                    "destinations": ["HND", "NRT", "TPE"],
+                    "airlines": None,  # No airline filter - will filter in results
+                    "max_miles": 75000,
+                    "direct_only": True,
+                    # Store original route preferences for filtering
+                    "route_preferences": [
+                        {"origins": ["ORD", "DFW"], "destinations": ["HND", "NRT"], "airlines": ["AA"]},
+                        {"origins": ["LAX", "SFO"], "destinations": ["TPE"], "airlines": ["JX"]}
+                    ]
+                }
+            ],
+            "aeroplan": [
+                {
+                    "name": "ORD/LAX/SFO/SEA→TPE/HND/NRT (Direct only)",
+                    "origins": ["ORD", "LAX", "SFO", "SEA"],
+                    "destinations": ["TPE", "HND", "NRT"],
+                    "airlines": None,
+                    "max_miles": 87500,
+                    "direct_only": True
+                }
+            ]
+        }
+    }
+}
+
+def build_search_tasks(search_config):
+    """Flatten the search config into per-route tasks with filter settings resolved up front"""
+    tasks = []
+    for period_name, period_config in search_config.items():
+        start_date, end_date = period_config["date_range"]
+
+        for program, routes in period_config["routes"].items():
+            for route_config in routes:
+                route_preferences = route_config.get("route_preferences")
+                tasks.append({
+                    "period_name": period_name,
+                    "program": program,
+                    "name": route_config["name"],
+                    "start_date": start_date,
+                    "end_date": end_date,
+                    "cabin": route_config.get("cabin", "business"),
+                    "direct_only": route_config.get("direct_only", False),
+                    "origins": route_config["origins"],
+                    "destinations": route_config["destinations"],
+                    "origins_set": frozenset(route_config["origins"]),
+                    "destinations_set": frozenset(route_config["destinations"]),
+                    "max_miles": route_config["max_miles"],
+                    "pref_index": build_route_preference_index(route_preferences) if route_preferences else None,
+                    "airline_pattern": compile_airline_pattern(route_config.get("airlines"))
+                })
+    return tasks
+
+def group_search_tasks(tasks):
+    """Merge tasks sharing dates/cabin/direct flag into one query over the union of airports"""
+    groups = {}
+    for task in tasks:
+        key = (task["start_date"], task["end_date"], task["direct_only"], task["cabin"])
+        group = groups.setdefault(key, {
+            "start_date": task["start_date"],
+            "end_date": task["end_date"],
+            "direct_only": task["direct_only"],
+            "cabin": task["cabin"],
+            "origins": [],
+            "destinations": [],
+            "sources": [],
+            "tasks": []
+        })
+        group["origins"] += [o for o in task["origins"] if o not in group["origins"]]
+        group["destinations"] += [d for d in task["destinations"] if d not in group["destinations"]]
+        if task["program"] not in group["sources"]:
+            group["sources"].append(task["program"])
+        group["tasks"].append(task)
+
+    for group in groups.values():
+        group["origins_csv"] = ",".join(group["origins"])
+        group["destinations_csv"] = ",".join(group["destinations"])
+        group["sources_csv"] = ",".join(group["sources"])
+    return list(groups.values())
+
+# The search config is static, so flatten and merge it once at import
+_SEARCH_TASKS = build_search_tasks(_SEARCH_CONFIG)
+_SEARCH_GROUPS = group_search_tasks(_SEARCH_TASKS)
+
+def _fetch(group):
+    """Fetch flight data for a merged group of routes"""
+    for task in group["tasks"]:
+        print(f"Searching {task['name']} for {task['program']}...")
+
+    data = check_seats(
+        group["origins_csv"],
+        group["destinations_csv"],
+        group["start_date"],
+        group["end_date"],
+        cabin=group["cabin"],
+        direct_only=group["direct_only"],
+        sources=group["sources_csv"]
+    )
+    # Bucket rows with business seats by program so each route only walks its own program's rows
+    by_source = defaultdict(list)
+    if data and data.get("data"):
+        for item in data["data"]:
+            if has_business_availability(item):
+                by_source[(item.get("Route") or _EMPTY).get("Source", "").lower()].append(item)
+
+    return group, by_source
+
+def filter_route_results(items, task):
+    """Filter available seats.aero items for a program down to the flights matching one search task"""
+    results = []
+
+    # Per-route settings are fixed for the whole sweep - bind them once
+    origins = task["origins_set"]
+    destinations = task["destinations_set"]
+    max_miles = task["max_miles"]
+    pref_index = task["pref_index"]
+    airline_pattern = task["airline_pattern"]
+    direct_only = task["direct_only"]
+
+    for item in items:
+        # Resolve the nested route fields once per item
+        route = item.get("Route") or _EMPTY
+        origin = route.get("OriginAirport", "")
+        destination = route.get("DestinationAirport", "")
+
+        # Check route endpoints (queries are merged across routes)
+        if origin not in origins or destination not in destinations:
             continue
 
-        # Check destination match
-        if destination not in pref["destinations"]:
+        # Check miles limit
+        miles = int(item.get("JMileageCost", 0) or 0)
+        if miles > max_miles:
             continue
 
-        # Check airline requirement (if specified)
-        if pref["airlines"]:
-            if not any(airline in airlines for airline in pref["airlines"]):
+        # Check route preferences (for merged Alaska routes)
+        if pref_index:
+            if not filter_by_route_preferences(item, pref_index):
+                continue
+        else:
+            # Check airline requirements (for non-merged routes like Aeroplan)
+            if not filter_by_airline(item, airline_pattern):
                 continue
 
-        # All criteria match for this preference
-        return True
+        # Check direct flight requirement
+        if not filter_by_direct(item, direct_only):
+            continue
 
-    return False
+        # Add to results
+        result = {
+            "period": task["period_name"],
+            "program": task["program"],
+            "route_name": task["name"],
+            "origin": origin,
+            "destination": destination,
+            "date": item.get("Date", ""),
+            "miles": miles,
+            "seats": item.get("JRemainingSeats", 0),
+            "airlines": item.get("JAirlines", ""),
+            "is_direct": item.get("JDirect", False)
+        }
+        results.append(result)
+
+    return results
 
 def search_routes():
     """Search all defined routes for target periods"""
 
-    # Define search configurations for your target periods (Optimized for fewer API calls)
-    searches = {
-        # December 5-15, 2025 (US to Asia)
-        "dec_us_to_asia": {
-            "date_range": ("2025-12-05", "2025-12-15"),
-            "routes": {
-                "alaska": [
-                    {
-                        "name": "ORD→HKG (Any airline, connecting OK)",
-                        "origins": ["ORD"],
-                        "destinations": ["HKG"],
-                        "airlines": None,  # Any airline
-                        "max_miles": 85000
-                    },
-                    {
-                        "name": "US→Asia (Direct flights only)",
-                        "origins": ["ORD", "DFW", "LAX", "SFO"],
-                        "destinations": ["HND", "NRT", "TPE"],
-                        "airlines": None,  # No airline filter - will filter in results
-                        "max_miles": 75000,
-                        "direct_only": True,
-                        # Store original route preferences for filtering
-                        "route_preferences": [
-                            {"origins": ["ORD", "DFW"], "destinations": ["HND", "NRT"], "airlines": ["AA"]},
-                            {"origins": ["LAX", "SFO"], "destinations": ["TPE"], "airlines": ["JX"]}
-                        ]
-                    }
-                ],
-                "aeroplan": [
-                    {
-                        "name": "ORD/LAX/SFO/SEA→TPE/HND/NRT (Direct only)",
-                        "origins": ["ORD", "LAX", "SFO", "SEA"],
-                        "destinations": ["TPE", "HND", "NRT"],
-                        "airlines": None,
-                        "max_miles": 87500,
-                        "direct_only": True
-                    }
-                ]
-            }
-        }
-    }
+    # Fetch all groups concurrently - the calls are independent and I/O bound
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        futures = [executor.submit(_fetch, group) for group in _SEARCH_GROUPS]
 
-    all_results = []
+        all_results = []
 
-    for period_name, period_config in searches.items():
-        start_date, end_date = period_config["date_range"]
+        # Consume in submission order so results stay deterministic
+        for future in futures:
+            group, by_source = future.result()
 
-        for program, routes in period_config["routes"].items():
-            for route_config in routes:
-                print(f"Searching {route_config['name']} for {program}...")
-
-                # Get flight data
-                data = check_seats(
-                    route_config["origins"],
-                    route_config["destinations"],
-                    start_date,
-                    end_date,
-                    direct_only=route_config.get("direct_only", False)
-                )
-
-                if not data or not data.get("data"):
-                    continue
-
-                # Filter results
-                for item in data["data"]:
-                    source = item.get("Route", {}).get("Source", "").lower()
-
-                    # Check program match
-                    if source != program:
-                        continue
-
-                    # Check if business class available
-                    if not item.get("JAvailable") or item.get("JRemainingSeats", 0) <= 0:
-                        continue
-
-                    # Check miles limit
-                    miles = int(item.get("JMileageCost", 0) or 0)
-                    if miles > route_config["max_miles"]:
-                        continue
-
-                    # Check route preferences (for merged Alaska routes)
-                    if route_config.get("route_preferences"):
-                        if not filter_by_route_preferences(item, route_config["route_preferences"]):
-                            continue
-                    else:
-                        # Check airline requirements (for non-merged routes like Aeroplan)
-                        if not filter_by_airline(item, route_config.get("airlines")):
-                            continue
-
-                    # Check direct flight requirement
-                    if not filter_by_direct(item, route_config.get("direct_only", False)):
-                        continue
-
-                    # Add to results
-                    result = {
-                        "period": period_name,
-                        "program": program,
-                        "route_name": route_config["name"],
-                        "origin": item.get("Route", {}).get("OriginAirport", ""),
-                        "destination": item.get("Route", {}).get("DestinationAirport", ""),
-                        "date": item.get("Date", ""),
-                        "miles": miles,
-                        "seats": item.get("JRemainingSeats", 0),
-                        "airlines": item.get("JAirlines", ""),
-                        "is_direct": item.get("JDirect", False)
-                    }
-                    all_results.append(result)
+            for task in group["tasks"]:
+                all_results.extend(filter_route_results(by_source.get(task["program"], ()), task))
 
     return all_results
 
-def create_found_message(results):
+def create_found_message(results, now_str):
     """Create message when flights are found"""
     if not results:
         return None
 
-    # Group by period and program
-    by_period = {}
+    # Group by period and program in a single pass
+    by_period = defaultdict(lambda: defaultdict(list))
     for result in results:
-        period = result["period"]
-        program = result["program"]
+        by_period[result["period"]][result["program"]].append(result)
 
-        if period not in by_period:
-            by_period[period] = {}
-        if program not in by_period[period]:
-            by_period[period][program] = []
-
-        by_period[period][program].append(result)
-
-    # Sort results within each group
-    for period in by_period:
-        for program in by_period[period]:
-            by_period[period][program].sort(key=lambda x: (x["date"], x["miles"]))
-
-    # Create message
-    current_time = get_current_time()
-    message = f"🚨 *FLIGHTS FOUND!* 🚨\n📅 {current_time.strftime('%Y-%m-%d %H:%M UTC')}\n\n"
+    # Create message (collect parts and join once to avoid repeated string copies)
+    parts = [f"🚨 *FLIGHTS FOUND!* 🚨\n📅 {now_str}\n\n"]
 
     for period, programs in by_period.items():
         period_title = "🎄 Dec 5-15: US→Asia"
-        message += f"{period_title}\n"
+        parts.append(f"{period_title}\n")
 
         for program, flights in programs.items():
-            program_emoji = "🇺🇸" if program == "alaska" else "🇨🇦"
-            message += f"\n{program_emoji} *{program.upper()}*: {len(flights)} found\n"
+            program_emoji = _PROGRAM_EMOJI.get(program, "🎫")
+            parts.append(f"\n{program_emoji} *{program.upper()}*: {len(flights)} found\n")
 
             # Group by route name
-            by_route = {}
+            by_route = defaultdict(list)
             for flight in flights:
-                route = flight["route_name"]
-                if route not in by_route:
-                    by_route[route] = []
-                by_route[route].append(flight)
-
-            for route_name, route_flights in by_route.items():
-                message += f"  📍 *{route_name}*:\n"
-                for flight in route_flights[:5]:  # Limit to 5 per route for readability
+                by_route[flight["route_name"]].append(flight)
+
+            # Routes holding the earliest/cheapest flight come first
+            sorted_routes = sorted(by_route.items(), key=lambda kv: min((x["date"], x["miles"]) for x in kv[1]))
+
+            for route_name, route_flights in sorted_routes:
+                parts.append(f"  📍 *{route_name}*:\n")
+                # Only the earliest/cheapest 5 per route are shown, so avoid sorting the whole group
+                top_flights = heapq.nsmallest(5, route_flights, key=lambda x: (x["date"], x["miles"]))
+                for flight in top_flights:
                     direct_indicator = "✈️" if flight["is_direct"] else "🔄"
-                    message += f"    {direct_indicator} `{flight['origin']}→{flight['destination']}` {flight['date']}\n"
-                    message += f"       💺 {flight['miles']:,d} miles ({flight['seats']} seats) [{flight['airlines']}]\n\n"
+                    parts.append(f"    {direct_indicator} `{flight['origin']}→{flight['destination']}` {flight['date']}\n")
+                    parts.append(f"       💺 {flight['miles']:,d} miles ({flight['seats']} seats) [{flight['airlines']}]\n\n")
 
                 if len(route_flights) > 5:
-                    message += f"    ... and {len(route_flights) - 5} more flights\n\n"
+                    parts.append(f"    ... and {len(route_flights) - 5} more flights\n\n")
 
-        message += "\n"
+        parts.append("\n")
 
-    return message
+    return "".join(parts)
 
 def get_last_daily_message():
     """Read last daily message timestamp from file"""
@@ -289,15 +530,13 @@ def get_last_daily_message():
 def save_last_daily_message(timestamp):
     """Save last daily message timestamp to file"""
     try:
-        with open(DAILY_TIMESTAMP_FILE, 'w') as f:
-            f.write(timestamp.isoformat())
+        write_file_atomic(DAILY_TIMESTAMP_FILE, timestamp.isoformat())
         print(f"✅ Saved daily timestamp: {timestamp.isoformat()}")
     except Exception as e:
         print(f"Error saving daily timestamp: {e}")
 
-def should_send_daily_message():
+def should_send_daily_message(now):
     """Check if we should send daily 'no flights' message"""
-    now = get_current_time()
     current_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
 
     last_daily_message = get_last_daily_message()
@@ -309,35 +548,35 @@ def should_send_daily_message():
 
     return False
 
-def create_no_flights_message():
+def create_no_flights_message(now_str):
     """Create daily 'no flights found' message"""
-    current_time = get_current_time()
-    return f"📊 *Daily Update*\n📅 {current_time.strftime('%Y-%m-%d %H:%M UTC')}\n\n❌ No flights found matching criteria\n\n🔍 Monitoring:\n🎄 Dec 5-15, 2025: US→Asia\n\n⏰ Next check in 5 minutes..."
+    return f"📊 *Daily Update*\n📅 {now_str}\n\n❌ No flights found matching criteria\n\n🔍 Monitoring:\n🎄 Dec 5-15, 2025: US→Asia\n\n⏰ Next check in 5 minutes..."
 
 def check_flights_once():
     """Check flights once - called by cron every 5 minutes"""
     try:
-        current_time = get_current_time()
-        print(f"🔍 Checking flights at {current_time.strftime('%Y-%m-%d %H:%M:%S UTC')}")
+        # Timestamp the whole tick once and reuse it in every message
+        now = get_current_time()
+        now_str = now.strftime('%Y-%m-%d %H:%M UTC')
+        print(f"🔍 Checking flights at {now.strftime('%Y-%m-%d %H:%M:%S UTC')}")
 
         # Search for flights
         results = search_routes()
 
         if results:
             # Flights found - send immediate notification
-            message = create_found_message(results)
+            message = create_found_message(results, now_str)
             if message:
                 print(f"🚨 FOUND {len(results)} FLIGHTS - sending notification!")
                 send_telegram_message(message)
         else:
             # No flights found - check if we should send daily update
-            if should_send_daily_message():
+            if should_send_daily_message(now):
                 print("📬 Sending daily 'no flights' update")
-                success = send_telegram_message(create_no_flights_message())
+                success = send_telegram_message(create_no_flights_message(now_str))
                 # Only save timestamp if message was sent successfully
                 if success:
-                    current_time = get_current_time()
-                    current_day = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
+                    current_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
                     save_last_daily_message(current_day)
             else:
                 print("❌ No flights found - waiting for next check")